@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
-import json
+import codecs
+import heapq
 import os
-import platform
+import re
 import shlex
 import shutil
 import sys
 import subprocess
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass, field
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
-from change_ros2agiros import change_ros2agiros_tag 
-from debian_dep_sort import compute_series_toposort, discover_debian_package_dirs
-from debuild_runner import auto_mark_prebuilt_packages
 from os_base import get_sys_info
 
 try:
@@ -28,6 +31,11 @@ try:
 except Exception:
     questionary = None
 
+try:
+    import orjson
+except Exception:  # pragma: no cover - optional dependency
+    orjson = None
+
 
 console = Console()
 REPO_ROOT = Path(__file__).resolve().parent
@@ -37,8 +45,44 @@ try:
 except Exception:  # pragma: no cover - optional dependency
     load_dotenv = None
 
-if load_dotenv:
-    load_dotenv(dotenv_path=REPO_ROOT / ".env", override=False)
+
+@lru_cache(maxsize=1)
+def _load_env_once() -> None:
+    if load_dotenv:
+        load_dotenv(dotenv_path=REPO_ROOT / ".env", override=False)
+
+
+_load_env_once()
+
+
+@lru_cache(maxsize=1)
+def _sys_info() -> Tuple[str, str, str, str, str]:
+    """Probe the host system once, on first use: (name, version, codename, arch, python)."""
+    return get_sys_info()
+
+
+def _json_loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    import json
+
+    return json.loads(data)
+
+
+def _json_dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    import json
+
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write via a sibling temp file + os.replace so readers never see a torn file."""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp_path, path)
 
 
 def _fallback_select(message: str, choices: Sequence[str], multiselect: bool = False):
@@ -102,21 +146,88 @@ def ask_confirm(message: str, default: bool = True) -> bool:
     return raw in {"y", "yes"}
 
 
-def run_stream(cmd: Sequence[str], cwd: Optional[Path] = None, env: Optional[Dict[str, str]] = None) -> int:
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_PIPESIZE = 1024 * 1024
+F_SETPIPE_SZ = 1031  # Linux fcntl 常量，Python < 3.10 的 fcntl 模块未导出
+
+
+def _enlarge_pipe(fd: int) -> None:
+    try:
+        import fcntl
+
+        fcntl.fcntl(fd, F_SETPIPE_SZ, STREAM_PIPESIZE)
+    except Exception:
+        pass
+
+
+def run_stream(
+    cmd: Sequence[str],
+    cwd: Optional[Path] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> int:
+    """Run cmd and show its output; on a terminal the child writes to it directly."""
     display = " ".join(shlex.quote(str(x)) for x in cmd)
     working_dir = str(cwd or Path.cwd())
     console.print(f"[bold blue]$[/] {display}\n   [dim]cwd={working_dir}[/]")
+    if sys.stdout.isatty():
+        # 交互终端下子进程直接继承 tty 输出，Python 不再转发日志
+        returncode = subprocess.run(
+            list(map(str, cmd)),
+            cwd=str(cwd) if cwd else None,
+            env=env,
+            check=False,
+        ).returncode
+        if returncode != 0:
+            console.print(f"[bold red]命令退出码: {returncode}[/]")
+        return returncode
+    popen_kwargs: Dict[str, Any] = {}
+    if sys.version_info >= (3, 10):
+        popen_kwargs["pipesize"] = STREAM_PIPESIZE
     proc = subprocess.Popen(
         list(map(str, cmd)),
         cwd=str(cwd) if cwd else None,
         env=env,
-        text=True,
+        bufsize=0,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
+        **popen_kwargs,
     )
     assert proc.stdout is not None
-    for line in proc.stdout:
-        console.print(line.rstrip(), markup=False)
+    if "pipesize" not in popen_kwargs:
+        _enlarge_pipe(proc.stdout.fileno())
+    # 构建日志是纯文本：绕过 Rich，按管道中已有的数据整块写出；
+    # 无缓冲 read 有多少返回多少，不会因凑满一块而阻塞交互输出
+    out = console.file
+    raw_out = getattr(out, "buffer", None)
+    if raw_out is not None:
+        # 输出端有字节层时原样转发，省去解码再编码
+        out.flush()
+        last = b"\n"
+        while True:
+            chunk = proc.stdout.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            raw_out.write(chunk)
+            raw_out.flush()
+            last = chunk[-1:]
+        if last != b"\n":
+            # 子进程输出未以换行结尾时补一个，避免后续 console.print 接在同一行
+            raw_out.write(b"\n")
+            raw_out.flush()
+    else:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        last = b"\n"
+        while True:
+            chunk = proc.stdout.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            out.write(decoder.decode(chunk))
+            out.flush()
+            last = chunk[-1:]
+        out.write(decoder.decode(b"", final=True))
+        if last != b"\n":
+            out.write("\n")
+        out.flush()
     proc.wait()
     if proc.returncode != 0:
         console.print(f"[bold red]命令退出码: {proc.returncode}[/]")
@@ -138,13 +249,29 @@ class BuildTask:
 
 
 def to_display_name(state: "MenuState", pkg_path: Path) -> str:
-    try:
-        return str(pkg_path.relative_to(state.code_dir))
-    except ValueError:
-        return str(pkg_path)
+    # 等价于 relative_to 的纯字符串前缀判断；PurePath 会缓存 str()，无需额外 Path 分配
+    path_str = os.fspath(pkg_path)
+    base = str(state.code_dir)
+    if path_str == base:
+        return "."
+    prefix = base if base.endswith(os.sep) else base + os.sep
+    if path_str.startswith(prefix):
+        return path_str[len(prefix):]
+    return path_str
 
 
 @dataclass
+class _MetaEntry:
+    """Per-package metadata collected from legacy JSON queue lines."""
+    path: str = ""
+    kinds: Dict[str, List[str]] = field(default_factory=dict)
+
+
+# slots=True 需要 Python 3.10+；旧版本退回普通 dataclass
+_DATACLASS_SLOTS: Dict[str, bool] = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_DATACLASS_SLOTS)
 class MenuState:
     #_agiros_release_Tags: str = "loong/2025-12"
     #_ros2_release_Tags: str = "humble/2025-10-20" # 
@@ -191,7 +318,28 @@ class MenuState:
     build_queue: List[BuildTask] = field(default_factory=list)
     queue_packages: List[str] = field(default_factory=list)
     package_status: Dict[str, bool] = field(default_factory=dict)
-    os_name, os_version, os_codename, os_arch, python_version = get_sys_info()
+    _summary_cache: Optional[Tuple[Any, List[Tuple[str, str]]]] = field(default=None, repr=False, compare=False)
+    _queue_stamp: Optional[Tuple[Any, ...]] = field(default=None, repr=False, compare=False)
+
+    @property
+    def os_name(self) -> str:
+        return _sys_info()[0]
+
+    @property
+    def os_version(self) -> str:
+        return _sys_info()[1]
+
+    @property
+    def os_codename(self) -> str:
+        return _sys_info()[2]
+
+    @property
+    def os_arch(self) -> str:
+        return _sys_info()[3]
+
+    @property
+    def python_version(self) -> str:
+        return _sys_info()[4]
 
     def __post_init__(self) -> None:
         self.queue_file = self._normalize_path(self.queue_file)
@@ -216,22 +364,27 @@ class MenuState:
     def _prepend_env_path(self, env: Dict[str, str], key: str, new_value: Optional[str]) -> None:
         if not new_value:
             return
-        existing = env.get(key, "")
-        parts = [item for item in existing.split(":") if item]
-        parts = [item for item in parts if item != new_value]
-        env[key] = ":".join([new_value] + parts) if parts else new_value
+        existing = env.get(key)
+        if not existing:
+            env[key] = new_value
+            return
+        updated = ":".join([new_value, *(item for item in existing.split(":") if item and item != new_value)])
+        if updated != existing:
+            env[key] = updated
 
     def apply_install_prefix_env(self, env: Dict[str, str]) -> None:
         prefix = str(self.install_prefix)
         if not prefix:
             return
-        env["AGIROS_INSTALL_PREFIX"] = prefix
+        join = os.path.join
+        if env.get("AGIROS_INSTALL_PREFIX") != prefix:
+            env["AGIROS_INSTALL_PREFIX"] = prefix
         for key in ("AMENT_PREFIX_PATH", "CMAKE_PREFIX_PATH", "COLCON_PREFIX_PATH"):
             self._prepend_env_path(env, key, prefix)
-        self._prepend_env_path(env, "PKG_CONFIG_PATH", str(self.install_prefix / "lib/pkgconfig"))
-        self._prepend_env_path(env, "LD_LIBRARY_PATH", str(self.install_prefix / "lib"))
-        self._prepend_env_path(env, "PATH", str(self.install_prefix / "bin"))
-        self._prepend_env_path(env, "PYTHONPATH", str(self.install_prefix / "lib/python3/dist-packages"))
+        self._prepend_env_path(env, "PKG_CONFIG_PATH", join(prefix, "lib/pkgconfig"))
+        self._prepend_env_path(env, "LD_LIBRARY_PATH", join(prefix, "lib"))
+        self._prepend_env_path(env, "PATH", join(prefix, "bin"))
+        self._prepend_env_path(env, "PYTHONPATH", join(prefix, "lib/python3/dist-packages"))
 
     def build_env(self) -> Dict[str, str]:
         env = os.environ.copy()
@@ -266,17 +419,32 @@ class MenuState:
             "AGIROS_QUEUE_FILE": str(self.queue_file),
             "AGIROS_QUEUE_META": str(self.queue_meta_file),
         }
-        for key, value in mappings.items():
-            os.environ[key] = value
         if self.colcon_src_dir:
             colcon_src = self.colcon_src_dir.strip()
         else:
             colcon_src = "src" if (self.code_dir / "src").exists() else "."
-        os.environ["COLCON_SRC_DIR"] = colcon_src
+        mappings["COLCON_SRC_DIR"] = colcon_src
+        # 只写入变化的变量，os.environ 每次赋值都会调用 putenv
+        environ = os.environ
+        for key, value in mappings.items():
+            if environ.get(key) != value:
+                environ[key] = value
         self.apply_install_prefix_env(os.environ)
+        self._summary_cache = None
+
+    def summary_fingerprint(self) -> Tuple[Any, ...]:
+        """Identify the inputs of the state panel: environment plus queue file mtimes."""
+        mtimes: List[Optional[int]] = []
+        for path in (self.queue_file, self.queue_meta_file):
+            try:
+                mtimes.append(path.stat().st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return (tuple(sorted(os.environ.items())), *mtimes)
 
     def refresh_from_env(self) -> None:
         """Sync state fields from process-wide environment variables."""
+        _load_env_once()
         env = os.environ
 
         def _set_path(env_key: str, attr: str) -> None:
@@ -355,63 +523,80 @@ class MenuState:
         if not self.queue_meta_file.exists():
             self.queue_meta_file.write_text("{}", encoding="utf-8")
 
+    def queue_file_stamp(self) -> Tuple[Any, ...]:
+        """(path, mtime_ns, size) of the queue and meta files; None fields when a file is missing."""
+        stamp: List[Any] = []
+        for path in (self.queue_file, self.queue_meta_file):
+            try:
+                st = path.stat()
+                stamp.append((str(path), st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append((str(path), None, None))
+        return tuple(stamp)
+
+    def reload_queue_if_changed(self) -> bool:
+        """Re-read the queue only when the files changed since our last load or save."""
+        if self._queue_stamp == self.queue_file_stamp():
+            return False
+        self.load_queue_from_file()
+        return True
+
     def load_queue_from_file(self) -> List[BuildTask]:
         path = self.queue_file
         if not path.exists():
             self.build_queue = []
             self.queue_packages = []
             self.package_status = {}
+            self._queue_stamp = self.queue_file_stamp()
             return []
-        packages: List[str] = []
+        packages_dict: Dict[str, None] = {}
         status: Dict[str, bool] = {}
-        legacy_meta: Dict[str, Dict[str, Any]] = {}
-        with path.open("r", encoding="utf-8") as handle:
-            for raw_line in handle:
-                line = raw_line.strip()
-                if not line:
-                    continue
-                parsed: Optional[Any] = None
-                if line.startswith("{") and line.endswith("}"):
-                    try:
-                        parsed = json.loads(line)
-                    except json.JSONDecodeError:
-                        parsed = None
-                completed = False
-                name = ""
-                if isinstance(parsed, dict) and parsed.get("name"):
-                    name = str(parsed.get("name") or "").strip()
-                    completed = bool(parsed.get("completed", False))
-                    kind = str(parsed.get("kind", "debian"))
-                    path_str = str(parsed.get("path") or "")
-                    extra_raw = parsed.get("extra_args")
-                    extra_list: List[str] = []
-                    if isinstance(extra_raw, list):
-                        extra_list = [str(item) for item in extra_raw]
-                    elif extra_raw:
-                        extra_list = [str(extra_raw)]
-                    entry = legacy_meta.setdefault(name, {"path": path_str, "kinds": {}})
-                    if path_str:
-                        entry["path"] = path_str
-                    kinds_dict = entry.setdefault("kinds", {})
-                    if isinstance(kinds_dict, dict):
-                        kinds_dict[kind] = {"extra_args": extra_list}
-                else:
-                    if line.endswith("#"):
-                        completed = True
-                        line = line[:-1].strip()
-                    name = line.strip()
-                if name:
-                    name = Path(name).name
-                if not name:
-                    continue
-                if name not in packages:
-                    packages.append(name)
-                status[name] = status.get(name, False) or completed
+        legacy_meta: Dict[str, _MetaEntry] = {}
+        for raw_line in path.read_bytes().splitlines():
+            line_bytes = raw_line.strip()
+            if not line_bytes:
+                continue
+            # 纯包名行解析失败即回退为文本；orjson 的 JSONDecodeError 也是 ValueError
+            try:
+                parsed: Optional[Any] = _json_loads(line_bytes)
+            except ValueError:
+                parsed = None
+            completed = False
+            name = ""
+            if isinstance(parsed, dict) and parsed.get("name"):
+                name = str(parsed.get("name") or "").strip()
+                completed = bool(parsed.get("completed", False))
+                kind = str(parsed.get("kind", "debian"))
+                path_str = str(parsed.get("path") or "")
+                extra_raw = parsed.get("extra_args")
+                extra_list: List[str] = []
+                if isinstance(extra_raw, list):
+                    extra_list = [str(item) for item in extra_raw]
+                elif extra_raw:
+                    extra_list = [str(extra_raw)]
+                entry = legacy_meta.setdefault(name, _MetaEntry())
+                if path_str:
+                    entry.path = path_str
+                entry.kinds[kind] = extra_list
+            else:
+                line = line_bytes.decode("utf-8")
+                if line.endswith("#"):
+                    completed = True
+                    line = line[:-1].strip()
+                name = line.strip()
+            if name:
+                name = Path(name).name
+            if not name:
+                continue
+            packages_dict[name] = None
+            status[name] = status.get(name) or completed
+
+        packages = list(packages_dict)
 
         meta: Dict[str, Dict[str, object]]
         try:
-            meta_raw = self.queue_meta_file.read_text(encoding="utf-8")
-            loaded = json.loads(meta_raw) if meta_raw.strip() else {}
+            meta_raw = self.queue_meta_file.read_bytes()
+            loaded = _json_loads(meta_raw) if meta_raw.strip() else {}
             meta = loaded if isinstance(loaded, dict) else {}
         except Exception:
             meta = {}
@@ -445,13 +630,12 @@ class MenuState:
                 merged_path = ""
                 if isinstance(existing, dict):
                     merged_path = str(existing.get("path") or "")
-                info_path = str(info.get("path") or "")
-                path_to_use = info_path or merged_path
+                path_to_use = info.path or merged_path
                 merged_kinds: Dict[str, Any] = {}
                 if isinstance(existing, dict) and isinstance(existing.get("kinds"), dict):
                     merged_kinds.update(existing["kinds"])  # type: ignore[arg-type]
-                if isinstance(info.get("kinds"), dict):
-                    merged_kinds.update(info["kinds"])  # type: ignore[arg-type]
+                for kind, extra_list in info.kinds.items():
+                    merged_kinds[kind] = {"extra_args": extra_list}
                 meta[pkg] = {"path": path_to_use, "kinds": merged_kinds}
 
         tasks: List[BuildTask] = []
@@ -467,6 +651,7 @@ class MenuState:
                 base_path = Path(base_path_str).expanduser()
             else:
                 base_path = (self.code_dir / pkg).expanduser()
+            # 与其它地方一致使用解析后的真实路径，符号链接下 relative_to/相等比较才可靠
             try:
                 base_path = base_path.resolve()
             except Exception:
@@ -487,6 +672,7 @@ class MenuState:
         self.queue_packages = packages
         self.package_status = status
         self.build_queue = tasks
+        self._queue_stamp = self.queue_file_stamp()
         return tasks
 
     def save_queue(self, tasks: Optional[List[BuildTask]] = None) -> None:
@@ -502,22 +688,19 @@ class MenuState:
             seen.add(key)
             unique.append(task)
         tasks = unique
-        package_order = list(self.queue_packages)
-        for task in tasks:
-            package_name = task.path.name
-            if package_name not in package_order:
-                package_order.append(package_name)
-        # Remove packages without tasks
-        package_order = [pkg for pkg in package_order if any(t.path.name == pkg for t in tasks)]
+        # Remove packages without tasks; new packages keep task order at the tail
+        task_packages = {task.display_name for task in tasks}
+        candidates = dict.fromkeys(self.queue_packages)
+        candidates.update(dict.fromkeys(task.display_name for task in tasks))
+        package_order = [pkg for pkg in candidates if pkg in task_packages]
         status = {pkg: self.package_status.get(pkg, False) for pkg in package_order}
         self.queue_packages = package_order
         self.package_status = status
-        self.build_queue = []
-        for task in tasks:
-            task.display_name = task.path.name
-            self.build_queue.append(task)
+        self.build_queue = tasks
         self._write_queue_file()
         self._write_meta_from_tasks(tasks)
+        self._queue_stamp = self.queue_file_stamp()
+        self._summary_cache = None
 
     def append_task_to_queue(self, task: BuildTask) -> None:
         self.add_tasks([task])
@@ -529,28 +712,35 @@ class MenuState:
         self.queue_packages = []
         self.package_status = {}
         self.build_queue = []
+        self._queue_stamp = self.queue_file_stamp()
+        self._summary_cache = None
 
     def add_tasks(self, tasks: Sequence[BuildTask], *, reset_completed: bool = True) -> Tuple[int, int]:
         if not tasks:
             return (0, 0)
         added = 0
         total = 0
+        queue_pkg_set: Set[str] = set(self.queue_packages)
+        task_index: Dict[Tuple[str, str], BuildTask] = {}
+        for existing in self.build_queue:
+            task_index.setdefault((existing.path.name, existing.kind), existing)
         for task in tasks:
             total += 1
             package_name = task.path.name
             task.display_name = package_name
-            replaced = False
-            for existing in self.build_queue:
-                if existing.path.name == package_name and existing.kind == task.kind:
-                    existing.path = task.path
-                    existing.extra_args = list(task.extra_args)
-                    existing.display_name = package_name
-                    replaced = True
-                    break
-            if not replaced:
+            key = (package_name, task.kind)
+            existing = task_index.get(key)
+            replaced = existing is not None
+            if replaced:
+                existing.path = task.path
+                existing.extra_args = list(task.extra_args)
+                existing.display_name = package_name
+            else:
                 self.build_queue.append(task)
+                task_index[key] = task
                 added += 1
-            if package_name not in self.queue_packages:
+            if package_name not in queue_pkg_set:
+                queue_pkg_set.add(package_name)
                 self.queue_packages.append(package_name)
             if not replaced:
                 self.package_status[package_name] = False
@@ -563,10 +753,10 @@ class MenuState:
 
     def _write_queue_file(self) -> None:
         self.ensure_queue_file()
-        with self.queue_file.open("w", encoding="utf-8") as handle:
-            for pkg in self.queue_packages:
-                suffix = "#" if self.package_status.get(pkg) else ""
-                handle.write(f"{pkg}{suffix}\n")
+        status = self.package_status
+        lines = [f"{pkg}#" if status.get(pkg) else pkg for pkg in self.queue_packages]
+        text = "\n".join(lines) + ("\n" if lines else "")
+        _atomic_write_bytes(self.queue_file, text.encode("utf-8"))
 
     def _write_meta_from_tasks(self, tasks: List[BuildTask]) -> None:
         meta: Dict[str, Dict[str, object]] = {}
@@ -576,10 +766,9 @@ class MenuState:
             kinds = entry.setdefault("kinds", {})
             if isinstance(kinds, dict):
                 kinds[task.kind] = {"extra_args": list(task.extra_args)}
-        self.queue_meta_file.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+        _atomic_write_bytes(self.queue_meta_file, _json_dumps(meta))
 
     def summary_rows(self) -> List[Tuple[str, str]]:
-        
         return [
             ("操作系统", f"名称:{self.os_name} 版本:{self.os_version} 版本代号:{self.os_codename} 架构:{self.os_arch}"),
             ("Python 版本", self.python_version),
@@ -613,11 +802,18 @@ class MenuState:
 
 
 def render_state_panel(state: MenuState) -> None:
-    state.refresh_from_env()
+    cached = state._summary_cache
+    if cached is not None and cached[0] == state.summary_fingerprint():
+        rows = cached[1]
+    else:
+        state.refresh_from_env()
+        rows = state.summary_rows()
+        # 刷新过程中可能创建队列文件，指纹需在刷新之后计算
+        state._summary_cache = (state.summary_fingerprint(), rows)
     table = Table.grid(expand=False)
     table.add_column(justify="right", style="cyan", no_wrap=True)
     table.add_column(style="white", overflow="fold")
-    for key, value in state.summary_rows():
+    for key, value in rows:
         table.add_row(key, value)
     console.print(Panel(table, title="AGIROS 工具菜单", box=box.ROUNDED))
 
@@ -704,23 +900,42 @@ def list_code_packages(code_dir: Path) -> List[Path]:
     if not code_dir.exists():
         return []
 
-    depth_limited_packages: List[Path] = []
-    for root, dirs, files in os.walk(code_dir):
-        rel_parts = Path(root).relative_to(code_dir).parts
-        if len(rel_parts) > 2:
-            dirs[:] = []
+    # 广度优先扫描至多两级子目录；找到 package.xml 的目录即为包，不再向下
+    depth_limited_packages: List[str] = []
+    pending = deque([(str(code_dir), 0)])
+    while pending:
+        root, depth = pending.popleft()
+        subdirs: List[str] = []
+        found = False
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if depth < 2:
+                            subdirs.append(entry.path)
+                    elif entry.name == "package.xml" and not entry.is_dir():
+                        found = True
+                        break
+        except OSError:
             continue
-        if "package.xml" in files:
-            depth_limited_packages.append(Path(root))
-            dirs[:] = []
+        if found:
+            depth_limited_packages.append(root)
+        else:
+            pending.extend((path, depth + 1) for path in subdirs)
 
     if depth_limited_packages:
-        return sorted(set(depth_limited_packages), key=lambda p: str(p))
+        return [Path(p) for p in sorted(depth_limited_packages)]
 
     return [p for p in sorted(code_dir.iterdir()) if p.is_dir()]
 
 
+_OS_RELEASE_ID_RE = re.compile(rb"^ID=([^\n]+)", re.M)
+
+
+@lru_cache(maxsize=1)
 def detect_linux_distribution() -> Optional[str]:
+    import platform
+
     os_id = ""
     try:
         info = platform.freedesktop_os_release()  # type: ignore[attr-defined]
@@ -729,15 +944,12 @@ def detect_linux_distribution() -> Optional[str]:
     if isinstance(info, dict):
         os_id = str(info.get("ID", "")).lower()
     if not os_id:
-        os_release = Path("/etc/os-release")
-        if os_release.exists():
-            try:
-                for line in os_release.read_text(encoding="utf-8", errors="ignore").splitlines():
-                    if line.startswith("ID="):
-                        os_id = line.partition("=")[2].strip().strip('"').lower()
-                        break
-            except Exception:
-                os_id = ""
+        try:
+            match = _OS_RELEASE_ID_RE.search(Path("/etc/os-release").read_bytes())
+        except OSError:
+            match = None
+        if match:
+            os_id = match.group(1).decode("utf-8", errors="ignore").strip().strip('"').lower()
     if "ubuntu" in os_id:
         return "ubuntu"
     if "openeuler" in os_id:
@@ -749,12 +961,12 @@ def prompt_package_path(state: MenuState) -> Optional[Path]:
     packages = list_code_packages(state.code_dir)
     if not packages:
         console.print("[yellow]未在源码目录中发现包，建议手动输入路径。[/]")
-
-    def _resolve_package(choice_name: str) -> Optional[Path]:
-        for pkg in packages:
-            if to_display_name(state, pkg) == choice_name:
-                return pkg
-        return None
+    # 显示名只计算一次：关键字过滤扫描小写副本，选择结果按字典回查
+    entries = [(to_display_name(state, pkg), pkg) for pkg in packages]
+    entries_lower = [(display.lower(), display, pkg) for display, pkg in entries]
+    display_map: Dict[str, Path] = {}
+    for display, pkg in entries:
+        display_map.setdefault(display, pkg)
 
     while True:
         choice = ask_select("选择源码包目录", ["关键字查询", "手动输入", "返回"])
@@ -771,11 +983,7 @@ def prompt_package_path(state: MenuState) -> Optional[Path]:
                 console.print("[yellow]未输入关键字。[/]")
                 continue
             keyword_lower = keyword.lower()
-            matches: List[Tuple[str, Path]] = []
-            for pkg in packages:
-                display = to_display_name(state, pkg)
-                if keyword_lower in display.lower():
-                    matches.append((display, pkg))
+            matches = [(display, pkg) for lower, display, pkg in entries_lower if keyword_lower in lower]
             if not matches:
                 console.print(f"[yellow]未找到匹配 \"{keyword}\" 的源码包。[/]")
                 continue
@@ -785,29 +993,36 @@ def prompt_package_path(state: MenuState) -> Optional[Path]:
                 continue
             if selection == "重新搜索":
                 continue
-            pkg_path = _resolve_package(selection)
+            pkg_path = display_map.get(selection)
             if pkg_path:
                 return pkg_path
             console.print("[red]选择的包无法解析，请重试。[/]")
 
 
-def _packages_for_kind(state: MenuState, target_kind: str) -> List[str]:
-    return [
-        pkg
-        for pkg in state.queue_packages
-        if any(t.display_name == pkg and t.kind == target_kind for t in state.build_queue)
-    ]
+def _kind_names(state: MenuState, target_kind: str) -> Set[str]:
+    return {t.display_name for t in state.build_queue if t.kind == target_kind}
 
 
-def review_completed_packages(state: MenuState, target_kind: str) -> None:
-    packages = _packages_for_kind(state, target_kind)
+def _packages_for_kind(state: MenuState, target_kind: str, kind_names: Optional[Set[str]] = None) -> List[str]:
+    if kind_names is None:
+        kind_names = _kind_names(state, target_kind)
+    return [pkg for pkg in state.queue_packages if pkg in kind_names]
+
+
+def review_completed_packages(state: MenuState, target_kind: str, kind_names: Optional[Set[str]] = None) -> None:
+    packages = _packages_for_kind(state, target_kind, kind_names)
     if not packages:
         return
-    completed = [pkg for pkg in packages if state.package_status.get(pkg)]
-    pending = [pkg for pkg in packages if not state.package_status.get(pkg)]
+    status_get = state.package_status.get
+    completed: List[str] = []
+    pending: List[str] = []
+    for pkg in packages:
+        (completed if status_get(pkg) else pending).append(pkg)
     if completed:
         console.print("[cyan]已标记完成的包：[/] " + ", ".join(completed))
     if pending and ask_confirm("是否需要在开始前标记更多已完成的包 (#)?", default=False):
+        from debuild_runner import auto_mark_prebuilt_packages
+
         auto_marked = auto_mark_prebuilt_packages(state.queue_file, state.code_dir)
         if auto_marked:
             state.load_queue_from_file()
@@ -825,34 +1040,32 @@ def review_completed_packages(state: MenuState, target_kind: str) -> None:
 
 def optimize_debian_build_queue(state: MenuState) -> bool:
     """Reorder Debian tasks using dependency-aware topological sort."""
-    state.load_queue_from_file()
+    from debian_dep_sort import compute_series_toposort, discover_debian_package_dirs
+
+    # 队列文件未被外部修改时沿用内存中的队列；review 自身的改动已同步到内存与文件
+    state.reload_queue_if_changed()
     # 先让用户同步已完成的包（打 #），避免重复构建
     review_completed_packages(state, "debian")
-    state.load_queue_from_file()
 
-    debian_packages = [
-        task.display_name
-        for task in state.build_queue
-        if task.kind == "debian"
-    ]
-    if not debian_packages:
+    debian_names: Set[str] = set()
+    existing_entries: List[Tuple[str, Path]] = []
+    for task in state.build_queue:
+        if task.kind == "debian":
+            debian_names.add(task.display_name)
+            existing_entries.append((task.display_name, task.path))
+    if not existing_entries:
         console.print("[yellow]当前队列中没有 Debian 构建任务，无法优化排序。[/]")
         return False
 
+    status = state.package_status
     pending_packages = [
         pkg for pkg in state.queue_packages
-        if not state.package_status.get(pkg)
-        and any(t.display_name == pkg and t.kind == "debian" for t in state.build_queue)
+        if pkg in debian_names and not status.get(pkg)
     ]
     if not pending_packages:
         console.print("[cyan]没有待构建的 Debian 包，已全部标记为完成。[/]")
         return True
 
-    existing_entries = [
-        (task.display_name, task.path)
-        for task in state.build_queue
-        if task.kind == "debian"
-    ]
     package_dirs = discover_debian_package_dirs(state.code_dir, existing_entries)
     if not package_dirs:
         console.print("[red]未找到任何包含 debian/control 的源码包，无法构建依赖图。[/]")
@@ -874,16 +1087,22 @@ def optimize_debian_build_queue(state: MenuState) -> bool:
 
     # 拆成多个弱连通系列，组件间可并行；组件内保持拓扑序
     optimized_order: List[str] = []
+    seen: Set[str] = set()
     for idx, comp in enumerate(series, start=1):
         console.print(f"[cyan]系列 {idx}（{len(comp)} 个包，可并行于其他系列）：[/] " + ", ".join(comp))
         for pkg in comp:
-            if pkg not in optimized_order:
+            if pkg not in seen:
+                seen.add(pkg)
                 optimized_order.append(pkg)
 
     # 已完成的包保持在前（保持原顺序），未完成的按拓扑排序，其余尾部保持
-    completed_prefix = [pkg for pkg in state.queue_packages if state.package_status.get(pkg)]
-    seen: Set[str] = set(optimized_order)
-    tail = [pkg for pkg in state.queue_packages if pkg not in seen and pkg not in completed_prefix]
+    completed_prefix: List[str] = []
+    tail: List[str] = []
+    for pkg in state.queue_packages:
+        if status.get(pkg):
+            completed_prefix.append(pkg)
+        elif pkg not in seen:
+            tail.append(pkg)
     state.queue_packages = completed_prefix + optimized_order + tail
 
     existing_task_keys = {(task.display_name, task.kind) for task in state.build_queue}
@@ -901,14 +1120,16 @@ def optimize_debian_build_queue(state: MenuState) -> bool:
         added_packages.append(pkg)
 
     for pkg in optimized_order:
-        state.package_status.setdefault(pkg, False)
+        status.setdefault(pkg, False)
     order_map = {pkg: idx for idx, pkg in enumerate(state.queue_packages)}
-    state.build_queue.sort(
-        key=lambda task: (
-            order_map.get(task.display_name, len(order_map)),
-            0 if task.kind == "debian" else 1,
-        )
-    )
+    default_rank = len(order_map)
+    rank = order_map.get
+    decorated = [
+        ((rank(task.display_name, default_rank), 0 if task.kind == "debian" else 1), task)
+        for task in state.build_queue
+    ]
+    decorated.sort(key=itemgetter(0))
+    state.build_queue = [task for _, task in decorated]
     state.save_queue()
     if added_packages:
         console.print(f"[green]已将依赖包加入队列: {', '.join(added_packages)}[/]")
@@ -916,6 +1137,8 @@ def optimize_debian_build_queue(state: MenuState) -> bool:
     return True
 
 def ros2agiros_menu(state: MenuState) -> None:
+    from change_ros2agiros import change_ros2agiros_tag
+
     while True:
         scope = ask_select("请选择操作范围", ["单包", f"批量:{state.code_dir}", "返回"])
         if scope in (None, "返回"):
@@ -929,16 +1152,25 @@ def ros2agiros_menu(state: MenuState) -> None:
             change_ros2agiros_tag(state.code_dir, from_str=state.ros2_distro, to_str=state.agiros_distro)
         
 
-def build_bloom_command(state: MenuState, kind: str) -> List[str]:
-    base = shlex_split(state.bloom_bin)
-    if not base:
-        base = ["bloom-generate"]
+_BLOOM_SUBCOMMANDS = ("agirosdebian", "agirosrpm")
+
+
+@lru_cache(maxsize=8)
+def _parse_bloom_bin(bloom_bin: str) -> Tuple[Tuple[str, ...], bool]:
+    """Split bloom_bin once; the flag tells whether it already names the generator subcommand."""
+    base = shlex_split(bloom_bin) or ["bloom-generate"]
     text = " ".join(base)
-    if "generate_cmd" in text or text.endswith("agirosdebian") or text.endswith("agirosrpm"):
-        return base
+    has_subcommand = "generate_cmd" in text or text.endswith(_BLOOM_SUBCOMMANDS)
+    return tuple(base), has_subcommand
+
+
+def build_bloom_command(state: MenuState, kind: str) -> List[str]:
+    base, has_subcommand = _parse_bloom_bin(state.bloom_bin)
+    if has_subcommand:
+        return list(base)
     if kind == "debian":
-        return base + ["agirosdebian"]
-    return base + ["agirosrpm"]
+        return [*base, "agirosdebian"]
+    return [*base, "agirosrpm"]
 
 
 def run_single_bloom(state: MenuState, kind: str, package_path: Path, generate_gbp: bool = False) -> None:
@@ -1065,20 +1297,34 @@ def run_debuild_install(state: MenuState, path: Path) -> int:
     return run_stream(cmd, cwd=path, env=state.build_env())
 
 
-def apply_deb_build_options(env: Dict[str, str], parallel_hint: Optional[str], run_tests: bool) -> None:
-    """Ensure DEB_BUILD_OPTIONS keeps parallel hint and adds nocheck when skipping tests."""
-    options = [item for item in env.get("DEB_BUILD_OPTIONS", "").split() if item]
-    if parallel_hint:
-        parallel_token = f"parallel={parallel_hint}"
-        if not any(opt.startswith("parallel=") for opt in options):
-            options.append(parallel_token)
-    if not run_tests and "nocheck" not in options:
+def apply_deb_build_options(
+    env: Dict[str, str], parallel_hint: Optional[str], run_tests: bool, *, replace_parallel: bool = False
+) -> None:
+    """Ensure DEB_BUILD_OPTIONS keeps parallel hint and adds nocheck when skipping tests.
+
+    replace_parallel=True swaps an inherited parallel=N for parallel_hint instead of keeping it.
+    """
+    options = env.get("DEB_BUILD_OPTIONS", "").split()
+    if replace_parallel and parallel_hint:
+        options = [opt for opt in options if not opt.startswith("parallel=")]
+    has_parallel = False
+    has_nocheck = False
+    for opt in options:
+        if opt.startswith("parallel="):
+            has_parallel = True
+        elif opt == "nocheck":
+            has_nocheck = True
+    if parallel_hint and not has_parallel:
+        options.append(f"parallel={parallel_hint}")
+    if not run_tests and not has_nocheck:
         options.append("nocheck")
     if options:
         env["DEB_BUILD_OPTIONS"] = " ".join(options)
 
 
 def yaml_quote(value: str) -> str:
+    import json
+
     return json.dumps(value, ensure_ascii=True)
 
 
@@ -1090,14 +1336,39 @@ def resolve_colcon_src_dir(state: "MenuState") -> str:
     return "src" if (state.code_dir / "src").exists() else "."
 
 
+_WHICH_CACHE: Dict[Tuple[str, str], str] = {}
+
+
+def _which(name: str) -> Optional[str]:
+    """shutil.which keyed by PATH; only hits are cached so freshly installed tools are still found."""
+    key = (name, os.environ.get("PATH", ""))
+    found = _WHICH_CACHE.get(key)
+    if found is None:
+        found = shutil.which(name)
+        if found:
+            _WHICH_CACHE[key] = found
+    return found
+
+
+QUEUE_SAVE_INTERVAL = 2.0  # 串行构建时队列进度写盘的最小间隔（秒）
+DOCKER_SOCKET_TTL = 30.0
+_docker_socket_checked: Optional[Tuple[float, bool]] = None
+
+
 def docker_socket_available() -> bool:
+    global _docker_socket_checked
     if os.environ.get("DOCKER_HOST"):
         return True
+    now = time.monotonic()
+    if _docker_socket_checked and now - _docker_socket_checked[0] < DOCKER_SOCKET_TTL:
+        return _docker_socket_checked[1]
     sock = Path("/var/run/docker.sock")
     try:
-        return sock.exists() and sock.is_socket()
+        available = sock.exists() and sock.is_socket()
     except Exception:
-        return sock.exists()
+        available = sock.exists()
+    _docker_socket_checked = (now, available)
+    return available
 
 
 def ensure_cargo_bin_on_path(env: Dict[str, str]) -> None:
@@ -1137,9 +1408,9 @@ def resolve_colcon_deb_runner(tool_root: Path) -> Optional[List[str]]:
     ):
         if candidate.exists():
             return [str(candidate)]
-    if shutil.which("colcon-deb"):
+    if _which("colcon-deb"):
         return ["colcon-deb"]
-    if shutil.which("cargo"):
+    if _which("cargo"):
         manifest = tool_root / "Cargo.toml"
         if manifest.exists():
             return ["cargo", "run", "--bin", "colcon-deb", "--manifest-path", str(manifest), "--"]
@@ -1147,7 +1418,7 @@ def resolve_colcon_deb_runner(tool_root: Path) -> Optional[List[str]]:
 
 
 def auto_build_colcon_deb(state: MenuState, tool_root: Path) -> bool:
-    if not shutil.which("cargo"):
+    if not _which("cargo"):
         console.print("[red]未找到 cargo，无法自动构建 colcon-deb。请安装 Rust 或设置 COLCON_DEB_BIN。[/]")
         return False
     manifest = tool_root / "Cargo.toml"
@@ -1172,8 +1443,8 @@ def run_colcon_deb_fallback_build(state: MenuState) -> int:
         return 1
     env = state.build_env()
     ensure_cargo_bin_on_path(env)
-    if not shutil.which("rust-script"):
-        if shutil.which("cargo") and ask_confirm("未找到 rust-script，是否使用 cargo 安装?", default=True):
+    if not _which("rust-script"):
+        if _which("cargo") and ask_confirm("未找到 rust-script，是否使用 cargo 安装?", default=True):
             rc = run_stream(
                 ["cargo", "install", "rust-script", "--version", "0.35.0"],
                 cwd=tool_root,
@@ -1243,6 +1514,33 @@ def run_colcon_deb_parallel_build(state: MenuState) -> int:
     return run_stream(cmd, cwd=tool_root, env=env)
 
 
+def debuild_invocation(
+    state: MenuState,
+    path: Path,
+    extra_args: Optional[List[str]] = None,
+    run_tests: bool = True,
+    parallel: Optional[str] = None,
+) -> Optional[Tuple[List[str], Dict[str, str]]]:
+    """Return the debuild_runner.py command and environment for one package, or None if the script is missing."""
+    script = REPO_ROOT / "debuild_runner.py"
+    if not script.exists():
+        console.print(f"[bold red]未找到 {script}[/]")
+        return None
+    env = state.build_env()
+    env.setdefault("WORK_DIR", str(path))
+    if parallel:
+        env["PARALLEL"] = parallel
+    else:
+        env.setdefault("PARALLEL", state.deb_parallel)
+    # 显式指定的 parallel（并行调度按包分配的线程数）必须覆盖继承的 parallel=N
+    apply_deb_build_options(env, env.get("PARALLEL", state.deb_parallel), run_tests, replace_parallel=bool(parallel))
+    cmd: List[str] = [sys.executable, str(script), "--work-dir", str(path)]
+    if extra_args:
+        cmd.append("--")
+        cmd.extend(extra_args)
+    return cmd, env
+
+
 def run_debian_build(
     state: MenuState,
     path: Path,
@@ -1252,18 +1550,10 @@ def run_debian_build(
     run_tests: bool = True,
 ) -> int:
     if builder == "debuild":
-        script = REPO_ROOT / "debuild_runner.py"
-        if not script.exists():
-            console.print(f"[bold red]未找到 {script}[/]")
+        invocation = debuild_invocation(state, path, extra_args, run_tests)
+        if invocation is None:
             return 1
-        env = state.build_env()
-        env.setdefault("WORK_DIR", str(path))
-        env.setdefault("PARALLEL", state.deb_parallel)
-        apply_deb_build_options(env, env.get("PARALLEL", state.deb_parallel), run_tests)
-        cmd: List[str] = [sys.executable, str(script), "--work-dir", str(path)]
-        if extra_args:
-            cmd.append("--")
-            cmd.extend(extra_args)
+        cmd, env = invocation
         rc = run_stream(cmd, cwd=path, env=env)
         if rc == 0 and auto_install:
             install_rc = run_debuild_install(state, path)
@@ -1338,7 +1628,11 @@ def run_rpm_build(
         # unreachable
 
     rpm_dir = path / "rpm"
-    specs = sorted(rpm_dir.glob("*.spec")) if rpm_dir.exists() else []
+    try:
+        with os.scandir(rpm_dir) as it:
+            specs = sorted(Path(entry.path) for entry in it if entry.name.endswith(".spec") and entry.is_file())
+    except OSError:
+        specs = []
     if not specs:
         console.print(f"[yellow]{path} 未找到 rpm/*.spec[/]")
         return 1
@@ -1385,6 +1679,155 @@ def execute_build(
     return success
 
 
+def _build_one(commands: List[List[str]], cwd: str, env: Dict[str, str], log_path: str) -> int:
+    """Worker entry for parallel builds: run commands in order, output goes to log_path."""
+    with open(log_path, "w", encoding="utf-8") as log:
+        for cmd in commands:
+            log.write(f"$ {' '.join(shlex.quote(part) for part in cmd)}\n")
+            log.flush()
+            rc = subprocess.run(
+                cmd,
+                cwd=cwd,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                check=False,
+            ).returncode
+            if rc != 0:
+                return rc
+    return 0
+
+
+def run_parallel_debian_builds(
+    state: MenuState,
+    pending: Sequence[str],
+    run_tests: bool,
+    auto_install: bool,
+    max_parallel: int,
+) -> Tuple[List[str], bool]:
+    """Build pending Debian packages on up to max_parallel workers, starting each as soon as its dependencies finish."""
+    from debian_dep_sort import compute_build_dependencies, discover_debian_package_dirs
+
+    tasks_by_pkg = {task.display_name: task for task in state.build_queue if task.kind == "debian"}
+    existing_entries = [(pkg, task.path) for pkg, task in tasks_by_pkg.items()]
+    package_dirs = discover_debian_package_dirs(state.code_dir, existing_entries)
+    order_hint = {pkg: idx for idx, pkg in enumerate(state.queue_packages)}
+    # 找不到源码目录的包不参与依赖分析，按无依赖处理，不影响其余包
+    resolvable = [pkg for pkg in pending if pkg in package_dirs]
+    unresolvable = [pkg for pkg in pending if pkg not in package_dirs]
+    try:
+        order, waits_on, _ = compute_build_dependencies(package_dirs, resolvable, order_hint=order_hint)
+        order = order + unresolvable
+    except KeyError as exc:
+        # 依赖信息不完整时退化为按队列顺序逐个构建，与串行路径一致
+        console.print(f"[yellow]依赖分析失败 ({exc})，改为按队列顺序逐个构建[/]")
+        order, waits_on = list(pending), {}
+        max_parallel = 1
+    except ValueError as exc:
+        console.print(f"[red]检测到依赖环，无法并行构建: {exc}[/]")
+        return list(pending), True
+    if not order:
+        return [], False
+
+    try:
+        total_jobs = max(1, int(state.deb_parallel))
+    except ValueError:
+        total_jobs = os.cpu_count() or 4
+    workers = max(1, min(max_parallel, len(order)))
+    # 总编译线程数在并发的包之间平分，避免 N 个包各自再开满 PARALLEL 路
+    jobs_per_pkg = str(max(1, total_jobs // workers))
+    install_script = REPO_ROOT / "deb_install_any.py"
+
+    priority = {pkg: idx for idx, pkg in enumerate(order)}
+    dependents: Dict[str, List[str]] = {pkg: [] for pkg in order}
+    remaining: Dict[str, Set[str]] = {}
+    for pkg in order:
+        remaining[pkg] = set(waits_on.get(pkg, ()))
+        for dep in remaining[pkg]:
+            dependents[dep].append(pkg)
+    ready: List[Tuple[int, str]] = [(priority[pkg], pkg) for pkg in order if not remaining[pkg]]
+    heapq.heapify(ready)
+
+    failed: List[str] = []
+    blocked: List[str] = []
+    aborted = False
+    stop_submitting = False
+
+    def _block_dependents(root: str) -> None:
+        stack = list(dependents[root])
+        while stack:
+            pkg = stack.pop()
+            if pkg in remaining and pkg not in blocked:
+                blocked.append(pkg)
+                remaining.pop(pkg)
+                stack.extend(dependents[pkg])
+
+    console.print(f"[cyan]并行构建 {len(order)} 个包，最多 {workers} 路同时进行，每包 PARALLEL={jobs_per_pkg}[/]")
+    executor = ThreadPoolExecutor(max_workers=workers)
+    running: Dict[Future, Tuple[str, Path]] = {}
+    try:
+        while True:
+            while ready and not stop_submitting and len(running) < workers:
+                _, pkg = heapq.heappop(ready)
+                remaining.pop(pkg, None)
+                task = tasks_by_pkg[pkg]
+                invocation = debuild_invocation(state, task.path, task.extra_args, run_tests, parallel=jobs_per_pkg)
+                if invocation is None:
+                    failed.append(pkg)
+                    _block_dependents(pkg)
+                    continue
+                cmd, env = invocation
+                commands = [cmd]
+                if auto_install and install_script.exists():
+                    commands.append([sys.executable, str(install_script), "--work-dir", str(task.path)])
+                log_path = state.code_dir / f"{pkg}.build.log"
+                console.print(f"[cyan]开始构建 {pkg}[/]  [dim]日志: {log_path}[/]")
+                running[executor.submit(_build_one, commands, str(task.path), env, str(log_path))] = (pkg, log_path)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                pkg, log_path = running.pop(future)
+                try:
+                    rc = future.result()
+                except Exception as exc:
+                    console.print(f"[red]{pkg} 构建进程异常: {exc}[/]")
+                    rc = 1
+                if rc == 0:
+                    state.package_status[pkg] = True
+                    console.print(f"[green]{pkg} 构建完成[/]")
+                    for follower in dependents[pkg]:
+                        waiting = remaining.get(follower)
+                        if waiting is None:
+                            continue
+                        waiting.discard(pkg)
+                        if not waiting:
+                            heapq.heappush(ready, (priority[follower], follower))
+                else:
+                    state.package_status[pkg] = False
+                    failed.append(pkg)
+                    _block_dependents(pkg)
+                    console.print(f"[red]{pkg} 构建失败 (退出码 {rc})，日志: {log_path}[/]")
+                    if not stop_submitting and (ready or remaining) and not ask_confirm(
+                        "存在构建失败的包，继续构建其余不受影响的包?", default=False
+                    ):
+                        stop_submitting = True
+                        aborted = True
+                # 状态更新只在主线程进行，无需加锁
+                state.save_queue()
+    except KeyboardInterrupt:
+        aborted = True
+        executor.shutdown(wait=False, cancel_futures=True)
+        state.save_queue()
+        console.print("[yellow]已接收到暂停请求 (Ctrl+C)，当前进度已保存，可稍后继续。[/]")
+    else:
+        executor.shutdown(wait=True)
+    if blocked:
+        console.print("[yellow]因依赖构建失败而跳过：[/] " + ", ".join(blocked))
+    return failed + blocked, aborted
+
+
 def manage_build_queue(state: MenuState) -> None:
     while True:
         state.load_queue_from_file()
@@ -1406,9 +1849,12 @@ def manage_build_queue(state: MenuState) -> None:
                     handle_scan_and_generate(state)
                     state.load_queue_from_file()
                     continue
+            kinds_by_name: Dict[str, Set[str]] = {}
+            for task in state.build_queue:
+                kinds_by_name.setdefault(task.display_name, set()).add(task.kind)
             for idx, pkg in enumerate(state.queue_packages, start=1):
-                kinds = [task.kind for task in state.build_queue if task.display_name == pkg]
-                kinds_text = ", ".join(sorted(set(kinds))) if kinds else "-"
+                kinds = kinds_by_name.get(pkg, ())
+                kinds_text = ", ".join(sorted(kinds)) if kinds else "-"
                 mark = " #" if state.package_status.get(pkg) else ""
                 console.print(f"{idx}. {pkg}{mark} ({kinds_text})")
             if state.queue_packages and ask_confirm("移除包?", default=False):
@@ -1445,18 +1891,16 @@ def manage_build_queue(state: MenuState) -> None:
                 continue
             target_kind = "debian" if build_choice == "构建 Debian 包" else "rpm"
             run_tests = True
-            review_completed_packages(state, target_kind)
+            kind_names = _kind_names(state, target_kind)
+            review_completed_packages(state, target_kind, kind_names)
             auto_install_deb = False
+            max_parallel = 1
             if target_kind == "debian":
                 mode = ask_select("选择 Debian 编译方式", ["单线程编译", "并行编译", "返回"])
                 if mode in (None, "返回"):
                     continue
-                pending = [
-                    pkg
-                    for pkg in state.queue_packages
-                    if not state.package_status.get(pkg)
-                    and any(t.display_name == pkg and t.kind == "debian" for t in state.build_queue)
-                ]
+                status = state.package_status
+                pending = [pkg for pkg in state.queue_packages if pkg in kind_names and not status.get(pkg)]
                 if mode == "并行编译":
                     if not pending:
                         console.print("[cyan]没有待构建的 Debian 包，可通过扫描/添加任务生成。[/]")
@@ -1471,26 +1915,33 @@ def manage_build_queue(state: MenuState) -> None:
                     continue
                 auto_install_deb = ask_confirm("构建成功后自动安装生成的 deb 包吗?", default=False)
                 while True:
-                    pending = [
-                        pkg
-                        for pkg in state.queue_packages
-                        if not state.package_status.get(pkg)
-                        and any(t.display_name == pkg and t.kind == "debian" for t in state.build_queue)
-                    ]
+                    # 优化排序可能补入依赖任务，每轮重新取 Debian 包名集合
+                    kind_names = _kind_names(state, "debian")
+                    status = state.package_status
+                    pending = [pkg for pkg in state.queue_packages if pkg in kind_names and not status.get(pkg)]
                     if not pending:
                         console.print("[cyan]没有待构建的 Debian 包，可通过扫描/添加任务生成。[/]")
                         break
                     options = [
                         "使用 git-buildpackage (gbp)",
                         "使用 debuild -us -uc -b",
+                        "并行 debuild (N 路)",
                         "优化排序",
                     ]
                     selection = ask_select("选择 Debian 构建方式", options)
                     if selection == "优化排序":
                         optimize_debian_build_queue(state)
                         continue
-                    if selection == "使用 debuild -us -uc -b":
-                        debian_builder = "debuild"
+                    if selection == "并行 debuild (N 路)":
+                        default_parallel = str(max(1, (os.cpu_count() or 2) // 2))
+                        raw_parallel = ask_text("同时构建的包数量 N", default_parallel) or default_parallel
+                        try:
+                            max_parallel = max(1, int(raw_parallel))
+                        except ValueError:
+                            console.print(f"[yellow]无效的并行数 {raw_parallel}，使用 {default_parallel}[/]")
+                            max_parallel = int(default_parallel)
+                    if selection in ("使用 debuild -us -uc -b", "并行 debuild (N 路)"):
+                        debian_builder = "debuild" if selection == "使用 debuild -us -uc -b" else "debuild-parallel"
                         run_tests = ask_confirm("构建时需要运行测试吗？选择“否”将仅编译并跳过测试。", default=True)
                     else:
                         debian_builder = "gbp"
@@ -1499,11 +1950,7 @@ def manage_build_queue(state: MenuState) -> None:
                 if not pending:
                     continue
             else:
-                pending = [
-                    pkg
-                    for pkg in state.queue_packages
-                    if any(t.display_name == pkg and t.kind == "rpm" for t in state.build_queue)
-                ]
+                pending = [pkg for pkg in state.queue_packages if pkg in kind_names]
                 if not pending:
                     console.print("[cyan]队列中没有可构建的 RPM 包。[/]")
                     continue
@@ -1511,46 +1958,62 @@ def manage_build_queue(state: MenuState) -> None:
 
             failed_packages: List[str] = []
             aborted = False
-            queue_snapshot = list(state.queue_packages)
-            try:
-                for pkg in queue_snapshot:
-                    if pkg not in pending:
-                        continue
-                    tasks_for_pkg = [
-                        task
-                        for task in state.build_queue
-                        if task.display_name == pkg and task.kind == target_kind
-                    ]
-                    if not tasks_for_pkg:
-                        continue
-                    if target_kind == "debian" and state.package_status.get(pkg):
-                        console.print(f"[cyan]{pkg} 已标记完成，跳过")
-                        continue
-                    package_failed = False
-                    for task in tasks_for_pkg:
-                        if not execute_build(
-                            task,
-                            state,
-                            debian_builder=debian_builder,
-                            auto_install=auto_install_deb,
-                            run_tests=run_tests,
-                        ):
-                            package_failed = True
-                            break
-                    if package_failed:
-                        failed_packages.append(pkg)
-                        if target_kind == "debian":
-                            state.package_status[pkg] = False
-                        if not ask_confirm("继续执行剩余包?", default=True):
-                            aborted = True
-                            break
-                    else:
-                        if target_kind == "debian":
-                            state.package_status[pkg] = True
-                    state.save_queue()
-            except KeyboardInterrupt:
-                aborted = True
-                console.print("[yellow]已接收到暂停请求 (Ctrl+C)，当前进度已保存，可稍后继续。[/]")
+            if target_kind == "debian" and debian_builder == "debuild-parallel":
+                failed_packages, aborted = run_parallel_debian_builds(
+                    state, pending, run_tests, auto_install_deb, max_parallel
+                )
+            else:
+                queue_snapshot = list(state.queue_packages)
+                pending_set = set(pending)
+                tasks_by_name: Dict[str, List[BuildTask]] = {}
+                for task in state.build_queue:
+                    if task.kind == target_kind:
+                        tasks_by_name.setdefault(task.display_name, []).append(task)
+                # 进度按时间间隔合并写盘；循环结束、中止或 Ctrl+C 时再补写一次
+                last_save = time.monotonic()
+                unsaved = False
+                try:
+                    for pkg in queue_snapshot:
+                        if pkg not in pending_set:
+                            continue
+                        tasks_for_pkg = tasks_by_name.get(pkg)
+                        if not tasks_for_pkg:
+                            continue
+                        if target_kind == "debian" and state.package_status.get(pkg):
+                            console.print(f"[cyan]{pkg} 已标记完成，跳过")
+                            continue
+                        package_failed = False
+                        for task in tasks_for_pkg:
+                            if not execute_build(
+                                task,
+                                state,
+                                debian_builder=debian_builder,
+                                auto_install=auto_install_deb,
+                                run_tests=run_tests,
+                            ):
+                                package_failed = True
+                                break
+                        if package_failed:
+                            failed_packages.append(pkg)
+                            if target_kind == "debian":
+                                state.package_status[pkg] = False
+                            if not ask_confirm("继续执行剩余包?", default=True):
+                                aborted = True
+                                break
+                        else:
+                            if target_kind == "debian":
+                                state.package_status[pkg] = True
+                        unsaved = True
+                        if time.monotonic() - last_save >= QUEUE_SAVE_INTERVAL:
+                            state.save_queue()
+                            last_save = time.monotonic()
+                            unsaved = False
+                except KeyboardInterrupt:
+                    aborted = True
+                    console.print("[yellow]已接收到暂停请求 (Ctrl+C)，当前进度已保存，可稍后继续。[/]")
+                finally:
+                    if unsaved:
+                        state.save_queue()
 
             if failed_packages:
                 console.print("[yellow]以下包构建失败：[/]")
@@ -1781,36 +2244,48 @@ def handle_configuration(state: MenuState) -> None:
         state.update_env()
 
 
-def gather_log_candidates(state: MenuState) -> List[Path]:
-    candidates: List[Path] = []
-    seen: Set[str] = set()
+LOG_CANDIDATES_TTL = 2.0
+LOG_TAIL_CHARS = 4000
+_LOG_NAMES = frozenset({"download_log.txt", "failed_repos.txt", "fail.log"})
+_log_cache: Dict[str, Any] = {"key": None, "ts": 0.0, "val": []}
 
-    def _add(path: Path) -> None:
-        try:
-            resolved = path.resolve()
-        except Exception:
-            resolved = path
-        key = str(resolved)
-        if key in seen:
-            return
-        if resolved.exists() and resolved.is_file():
-            candidates.append(resolved)
-            seen.add(key)
 
-    base_dirs = [state.release_dir, state.code_dir, REPO_ROOT]
-    names = ["download_log.txt", "failed_repos.txt", "fail.log"]
-    patterns = ["*.log", "*log*.txt"]
+def _is_log_name(name: str) -> bool:
+    # 等价于 names 列表加上 "*.log"、"*log*.txt" 两个 glob
+    return name in _LOG_NAMES or name.endswith(".log") or (name.endswith(".txt") and "log" in name[:-4])
+
 
-    for base in base_dirs:
-        if not base or not base.exists():
+def gather_log_candidates(state: MenuState) -> List[Path]:
+    key = (str(state.release_dir), str(state.code_dir))
+    now = time.monotonic()
+    if _log_cache["key"] == key and now - _log_cache["ts"] < LOG_CANDIDATES_TTL:
+        return list(_log_cache["val"])
+
+    candidates: Dict[str, Path] = {}
+    for base in (state.release_dir, state.code_dir, REPO_ROOT):
+        if not base:
             continue
-        for name in names:
-            _add(base / name)
-        for pattern in patterns:
-            for path in base.glob(pattern):
-                _add(path)
+        try:
+            resolved_base = base.resolve()
+            it = os.scandir(resolved_base)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if not _is_log_name(entry.name):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    # 只有符号链接需要逐个解析，其余路径由已解析的 base 拼接即可
+                    path = Path(entry.path).resolve() if entry.is_symlink() else resolved_base / entry.name
+                except OSError:
+                    continue
+                candidates.setdefault(str(path), path)
 
-    return sorted(candidates, key=lambda p: str(p))
+    result = [candidates[k] for k in sorted(candidates)]
+    _log_cache.update(key=key, ts=now, val=result)
+    return list(result)
 
 
 def handle_logs(state: MenuState) -> None:
@@ -1830,8 +2305,17 @@ def handle_logs(state: MenuState) -> None:
         if not path.exists():
             console.print(f"[red]未找到 {path}[/]")
             continue
-        content = path.read_text(encoding="utf-8", errors="ignore")
-        console.print(Panel(Text(content if len(content) < 4000 else content[-4000:], style="white"), title=str(path), box=box.ROUNDED))
+        # 只读取文件末尾：UTF-8 每字符至多 4 字节，读 4 倍字节数足够取到末尾 LOG_TAIL_CHARS 个字符
+        try:
+            with path.open("rb") as handle:
+                size = os.fstat(handle.fileno()).st_size
+                handle.seek(max(0, size - LOG_TAIL_CHARS * 4))
+                raw = handle.read()
+        except OSError as exc:
+            console.print(f"[red]无法读取 {path}: {exc}[/]")
+            continue
+        content = raw.decode("utf-8", errors="ignore")[-LOG_TAIL_CHARS:]
+        console.print(Panel(Text(content, style="white"), title=str(path), box=box.ROUNDED))
         action = ask_select("日志查看", ["返回", "继续查看"])
         if action in (None, "返回"):
             return
@@ -6,15 +6,34 @@ import os
 import sys
 from pathlib import Path
 import shutil
+from typing import Iterator
 
 
 CODE_DIR = Path(os.environ.get("CODE_DIR", "/opt/code_dir")).expanduser()
+TARGET_DIR_NAMES = {"debian", "rpm"}
 
 
 def log(message: str) -> None:
     print(f"[INFO] {message}")
 
 
+def remove_generated_dirs(root: str) -> Iterator[str]:
+    """Delete matching directories under root, never descending into removed trees."""
+    try:
+        it = os.scandir(root)
+    except OSError:
+        return
+    with it:
+        for entry in it:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if entry.name.lower() in TARGET_DIR_NAMES:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                yield entry.path
+            else:
+                yield from remove_generated_dirs(entry.path)
+
+
 def main() -> int:
     if not CODE_DIR.exists():
         print(f"[WARN] CODE_DIR 不存在: {CODE_DIR}")
@@ -22,11 +41,9 @@ def main() -> int:
 
     log(f"清理 {CODE_DIR} 下的 debian/ 和 rpm/ 目录...")
     removed = 0
-    for directory in CODE_DIR.rglob("*"):
-        if directory.is_dir() and directory.name.lower() in {"debian", "rpm"}:
-            shutil.rmtree(directory, ignore_errors=True)
-            removed += 1
-            log(f"删除目录: {directory}")
+    for directory in remove_generated_dirs(str(CODE_DIR)):
+        removed += 1
+        log(f"删除目录: {directory}")
 
     log("清理完成。下次运行 oob_builder_procedural.py 会重新生成。")
     log(f"共移除 {removed} 个目录。")
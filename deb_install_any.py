@@ -4,14 +4,20 @@
 from __future__ import annotations
 
 import argparse
+import io
+import mmap
 import os
 import re
 import signal
 import subprocess
 import sys
+import tarfile
 import time
+from collections import deque
+from fnmatch import fnmatchcase
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable, List, Optional, Sequence, Set
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
 
 os.environ.setdefault("DEBIAN_FRONTEND", "noninteractive")
 REPO_ROOT = Path(__file__).resolve().parent
@@ -31,6 +37,10 @@ APT_MAX_RETRIES = int(os.environ.get("AGIROS_APT_MAX_RETRIES", "3"))
 LOCK_FILES = (Path("/var/lib/dpkg/lock-frontend"), Path("/var/lib/dpkg/lock"))
 APT_LOCK_PATH = Path(os.environ.get("AGIROS_APT_LOCKFILE", "/mnt/lfb_ws/.locks/apt.lock"))
 APT_LOCK_TIMEOUT = int(os.environ.get("AGIROS_APT_LOCK_TIMEOUT", "3600"))
+_LOCK_PID_RE = re.compile(r"process(?:\D+)?(\d+)", re.IGNORECASE)
+OUTPUT_TAIL_CHARS = 64 * 1024
+_CONTROL_PACKAGE_RE = re.compile(rb"^Package:[ \t]*(\S+)", re.MULTILINE)
+_PKG_PROC_RE = re.compile(r"apt-get| apt |dpkg|mk-build-deps|dpkg-buildpackage|debuild_runner")
 
 
 def print_info(message: str) -> None:
@@ -56,10 +66,17 @@ def get_helper_script() -> Path:
     return DEFAULT_HELPER_SCRIPT
 
 
+@lru_cache(maxsize=8)
+def _helper_available(override: Optional[str]) -> Tuple[Path, bool]:
+    # Keyed on AGIROS_BUILD_HELPERS so a changed override is re-checked.
+    helper = Path(override).expanduser().resolve() if override else DEFAULT_HELPER_SCRIPT
+    return helper, helper.exists()
+
+
 def run_apt_guard() -> None:
     global _APT_GUARD_MISSING_WARNED
-    helper = get_helper_script()
-    if not helper.exists():
+    helper, available = _helper_available(os.environ.get("AGIROS_BUILD_HELPERS"))
+    if not available:
         if not _APT_GUARD_MISSING_WARNED:
             print_warn(f"Apt guard script not found at {helper}, skipping dpkg state cleanup.")
             _APT_GUARD_MISSING_WARNED = True
@@ -95,53 +112,91 @@ def _print_process_output(proc: subprocess.CompletedProcess) -> None:
     sys.stderr.flush()
 
 
+def _run_streaming(cmd: Sequence[str], *, cwd: Path | None = None) -> subprocess.CompletedProcess:
+    """Forward merged output line by line, keeping only a bounded tail for lock detection."""
+    tail: deque[str] = deque()
+    tail_size = 0
+    with subprocess.Popen(
+        cmd,
+        cwd=str(cwd) if cwd else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+        bufsize=1,
+    ) as proc:
+        assert proc.stdout is not None
+        write = sys.stdout.write
+        for line in proc.stdout:
+            write(line)
+            tail.append(line)
+            tail_size += len(line)
+            while tail_size > OUTPUT_TAIL_CHARS and len(tail) > 1:
+                tail_size -= len(tail.popleft())
+        returncode = proc.wait()
+    sys.stdout.flush()
+    return subprocess.CompletedProcess(list(cmd), returncode, stdout="".join(tail), stderr="")
+
+
 def _extract_lock_pids(output: str) -> Set[int]:
-    pids: Set[int] = set()
-    for match in re.findall(r"process(?:\\D+)?(\\d+)", output, flags=re.IGNORECASE):
-        try:
-            pids.add(int(match))
-        except ValueError:
-            continue
-    return pids
+    return {int(match) for match in _LOCK_PID_RE.findall(output)}
+
+
+PROC_ROW_HEADER = f"{'PID':>7} {'PPID':>7} {'ELAPSED':>7} CMD"
+
+
+def _proc_row(pid: int, uptime: float, clk_tck: int) -> Optional[str]:
+    """Format pid/ppid/etimes/cmd for one process straight from procfs."""
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text()
+        cmdline = Path(f"/proc/{pid}/cmdline").read_bytes()
+    except OSError:
+        return None
+    comm, _, rest = stat.partition(" (")[2].rpartition(") ")
+    fields = rest.split()
+    if len(fields) < 20:
+        return None
+    etimes = max(0, int(uptime - int(fields[19]) / clk_tck))
+    cmd = cmdline.rstrip(b"\0").replace(b"\0", b" ").decode("utf-8", "replace") or f"[{comm}]"
+    return f"{pid:>7} {fields[1]:>7} {etimes:>7} {cmd}"
+
+
+def _proc_clock() -> Tuple[float, int]:
+    try:
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+    except (OSError, ValueError, IndexError):
+        uptime = 0.0
+    return uptime, os.sysconf("SC_CLK_TCK")
 
 
 def _maybe_print_process_details(pids: Set[int]) -> None:
     if not pids:
         return
-    try:
-        proc = subprocess.run(
-            ["ps", "-p", ",".join(str(pid) for pid in sorted(pids)), "-o", "pid,ppid,etimes,cmd"],
-            text=True,
-            capture_output=True,
-            check=False,
-        )
-        if proc.stdout:
-            print_info("Lock holders:")
-            sys.stdout.write(proc.stdout)
-    except Exception as exc:  # noqa: BLE001
-        print_warn(f"Unable to describe lock holders: {exc}")
+    uptime, clk_tck = _proc_clock()
+    rows = [row for row in (_proc_row(pid, uptime, clk_tck) for pid in sorted(pids)) if row]
+    if rows:
+        print_info("Lock holders:")
+        print(PROC_ROW_HEADER)
+        for row in rows:
+            print(row)
 
 
 def _print_related_package_processes() -> None:
-    patterns = ("apt-get", " apt ", "dpkg", "mk-build-deps", "dpkg-buildpackage", "debuild_runner")
     try:
-        proc = subprocess.run(
-            ["ps", "axo", "pid,ppid,etimes,cmd"],
-            text=True,
-            capture_output=True,
-            check=False,
-        )
-    except Exception as exc:  # noqa: BLE001
+        with os.scandir("/proc") as it:
+            pids = sorted(int(entry.name) for entry in it if entry.name.isdigit())
+    except OSError as exc:
         print_warn(f"Unable to list related processes: {exc}")
         return
-    if not proc.stdout:
-        return
-    lines = proc.stdout.splitlines()
-    header, *rows = lines
-    matches = [line for line in rows if any(pattern in line for pattern in patterns)]
+    uptime, clk_tck = _proc_clock()
+    matches = []
+    for pid in pids:
+        row = _proc_row(pid, uptime, clk_tck)
+        if row and _PKG_PROC_RE.search(row):
+            matches.append(row)
     if matches:
-        print_info("Related package processes (ps axo pid,ppid,etimes,cmd):")
-        print(header)
+        print_info("Related package processes (pid,ppid,etimes,cmd):")
+        print(PROC_ROW_HEADER)
         for line in matches:
             print(line)
 
@@ -282,19 +337,11 @@ def run_with_lock_retries(
     while attempts <= effective_max:
         effective_cmd = wrap_with_apt_lock(cmd, enable=use_apt_lock)
         print_info(f"$ {' '.join(effective_cmd)}")
-        proc = subprocess.run(
-            effective_cmd,
-            cwd=str(cwd) if cwd else None,
-            text=True,
-            capture_output=True,
-            check=False,
-        )
-        _print_process_output(proc)
+        proc = _run_streaming(effective_cmd, cwd=cwd)
         if proc.returncode == 0:
             return proc
 
-        combined = (proc.stdout or "") + "\\n" + (proc.stderr or "")
-        should_retry, consume_attempt = _handle_lock_and_recover(cmd, combined)
+        should_retry, consume_attempt = _handle_lock_and_recover(cmd, proc.stdout)
         if attempts < effective_max and should_retry:
             if consume_attempt:
                 attempts += 1
@@ -329,38 +376,96 @@ def parse_changelog_name(pkg_dir: Path) -> Optional[str]:
 def find_deb_candidates(pkg_dir: Path, pkg_name: Optional[str]) -> List[Path]:
     parent = pkg_dir.parent
     pattern = f"{pkg_name}_*.deb" if pkg_name else "*.deb"
-    candidates = [path for path in parent.glob(pattern) if path.is_file()]
-    filtered = [path for path in candidates if "-dbgsym_" not in path.name]
+    try:
+        with os.scandir(parent) as it:
+            entries = [entry for entry in it if fnmatchcase(entry.name, pattern) and entry.is_file()]
+    except OSError:
+        return []
+    filtered = [entry for entry in entries if "-dbgsym_" not in entry.name]
     if filtered:
-        candidates = filtered
-    candidates.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-    return candidates
+        entries = filtered
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [Path(entry.path) for entry in entries]
 
 
-def package_name_from_deb(deb_path: Path) -> str:
+def _read_deb_control(path: str) -> Optional[bytes]:
+    """Return the raw control file of a .deb by walking its ar members in place."""
+    try:
+        with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:8] != b"!<arch>\n":
+                return None
+            offset = 8
+            end = len(mm)
+            while offset + 60 <= end:
+                header = mm[offset : offset + 60]
+                name = header[:16].strip().rstrip(b"/")
+                size = int(header[48:58])
+                data_start = offset + 60
+                if name.startswith(b"control.tar"):
+                    member = io.BytesIO(mm[data_start : data_start + size])
+                    with tarfile.open(fileobj=member, mode="r:*") as tar:
+                        for info in tar:
+                            if info.isfile() and info.name.lstrip("./") == "control":
+                                extracted = tar.extractfile(info)
+                                return extracted.read() if extracted else None
+                    return None
+                offset = data_start + size + (size & 1)
+    except (OSError, ValueError, tarfile.TarError):
+        return None
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _package_name_from_deb_cached(path: str, mtime_ns: int, size: int) -> str:
+    control = _read_deb_control(path)
+    if control is not None:
+        match = _CONTROL_PACKAGE_RE.search(control)
+        if match:
+            return match.group(1).decode("utf-8", "replace")
     proc = subprocess.run(
-        ["dpkg-deb", "-f", str(deb_path), "Package"],
+        ["dpkg-deb", "-f", path, "Package"],
         text=True,
         capture_output=True,
         check=False,
     )
     if proc.returncode == 0:
-        name = proc.stdout.strip()
-        if name:
-            return name
-    return deb_path.name.split("_", 1)[0]
+        return proc.stdout.strip()
+    return ""
 
 
-def query_dpkg_status(pkg_name: str) -> str:
+def package_name_from_deb(deb_path: Path) -> str:
+    try:
+        st = deb_path.stat()
+    except OSError:
+        name = ""
+    else:
+        name = _package_name_from_deb_cached(str(deb_path), st.st_mtime_ns, st.st_size)
+    return name or deb_path.name.split("_", 1)[0]
+
+
+def query_dpkg_statuses(pkg_names: Sequence[str]) -> Dict[str, str]:
+    """Query db:Status-Abbrev for many packages with a single dpkg-query."""
+    names = [name for name in dict.fromkeys(pkg_names) if name]
+    if not names:
+        return {}
     proc = subprocess.run(
-        ["dpkg-query", "-W", "-f", "${db:Status-Abbrev}", pkg_name],
+        ["dpkg-query", "-W", "-f", "${Package} ${db:Status-Abbrev}\n", *names],
         text=True,
         capture_output=True,
         check=False,
     )
-    if proc.returncode != 0:
-        return ""
-    return proc.stdout.strip()
+    statuses: Dict[str, str] = {}
+    # Unknown names make dpkg-query exit 1 but the known ones are still listed.
+    for line in proc.stdout.splitlines():
+        name, _, status = line.partition(" ")
+        status = status.strip()
+        if name and status:
+            statuses.setdefault(name, status)
+    return statuses
+
+
+def query_dpkg_status(pkg_name: str) -> str:
+    return query_dpkg_statuses([pkg_name]).get(pkg_name, "")
 
 
 def purge_broken_package(pkg_name: str, assume_yes: bool) -> None:
@@ -400,8 +505,10 @@ def try_install_deb(path: Path) -> bool:
     return proc.returncode == 0
 
 
-def install_deb_with_recovery(path: Path, assume_yes: bool, allow_warning: bool) -> bool:
-    pkg_name = package_name_from_deb(path)
+def install_deb_with_recovery(
+    path: Path, assume_yes: bool, allow_warning: bool, pkg_name: Optional[str] = None
+) -> bool:
+    pkg_name = pkg_name or package_name_from_deb(path)
     print_info(f"Installing {path}")
     run_apt_guard()
     if try_install_deb(path):
@@ -427,9 +534,10 @@ def install_deb_with_recovery(path: Path, assume_yes: bool, allow_warning: bool)
 
 
 def gather_directory_debs(directory: Path) -> List[Path]:
-    files = sorted(
-        path for path in directory.glob("*.deb") if path.is_file()
-    )
+    with os.scandir(directory) as it:
+        files = sorted(
+            Path(entry.path) for entry in it if entry.name.endswith(".deb") and entry.is_file()
+        )
     return files
 
 
@@ -485,10 +593,11 @@ def main() -> None:
     args = parse_args()
     assume_yes = not args.no_assume_yes
     targets = resolve_targets(args)
+    pkg_names = {deb: package_name_from_deb(deb) for deb in targets}
     apt_update()
     failed: List[str] = []
     for deb in targets:
-        if not install_deb_with_recovery(deb, assume_yes, args.allow_install_fail_as_warning):
+        if not install_deb_with_recovery(deb, assume_yes, args.allow_install_fail_as_warning, pkg_names[deb]):
             failed.append(deb.name)
     if failed:
         raise SystemExit(f"[ERR ] Installation failed for: {', '.join(failed)}")
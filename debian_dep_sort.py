@@ -1,21 +1,74 @@
+import array
 import collections
 import heapq
 import os
 import re
+import stat
+import string
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Iterable, List, Mapping, Optional, Pattern, Sequence, Set, Tuple
+from typing import Dict, Iterable, Iterator, List, Mapping, MutableSequence, NamedTuple, Optional, Sequence, Set, Tuple
+
+# Debian 包名字符集；不含 ":"，以便在架构限定符处截断
+_PKGNAME_CHARS = frozenset(string.ascii_letters + string.digits + "+_.-")
+_FIELD_RE = re.compile(r"([^:]+?)\s*:\s*(.*)")
+CONTROL_READ_PARALLEL_MIN = 8
+# 包名与字段名统一驻留，集合/字典比较时可按指针短路
+_DEPENDS_FIELDS = [sys.intern(field) for field in ("Depends", "Build-Depends", "Build-Depends-Indep", "Build-Depends-Arch")]
+# 按路径缓存 (mtime_ns, size, 段落列表)；文件变化时覆盖旧条目，缓存大小不超过包数量
+_STANZA_CACHE: Dict[str, Tuple[int, int, List[Dict[str, str]]]] = {}
+
+
+class _CSRGraph(NamedTuple):
+    names: List[str]
+    ids: Dict[str, int]
+    adj_indptr: List[int]
+    adj_indices: List[int]
+    rev_indptr: List[int]
+    rev_indices: List[int]
+    in_degree: "array.array[int]"
+
+
+class _DisjointSet:
+    """按秩合并、路径减半的并查集，元素为 0..n-1 的整数编号。"""
+
+    __slots__ = ("parent", "rank")
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.rank = [0] * n
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return
+        rank = self.rank
+        if rank[ra] < rank[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        if rank[ra] == rank[rb]:
+            rank[ra] += 1
 
 
 class PackageDepGraph:
     """Represents dependencies between Debian packages discovered from control files."""
 
     def __init__(self, package_dirs: Mapping[str, Path], order_hint: Optional[Mapping[str, int]] = None):
-        self.package_dirs = {name: path for name, path in package_dirs.items()}
+        self.package_dirs = {sys.intern(name): path for name, path in package_dirs.items()}
         self.order_hint = dict(order_hint or {})
         self.nodes: Set[str] = set(self.package_dirs.keys())
         self.adj: Dict[str, Set[str]] = collections.defaultdict(set)
         self.rev: Dict[str, Set[str]] = collections.defaultdict(set)
         self.unresolved: Dict[str, Set[str]] = collections.defaultdict(set)
+        self._csr: Optional[_CSRGraph] = None
         for pkg in self.nodes:
             self.adj.setdefault(pkg, set())
             self.rev.setdefault(pkg, set())
@@ -25,80 +78,168 @@ class PackageDepGraph:
             return
         self.adj[prereq].add(dependent)
         self.rev[dependent].add(prereq)
+        self._invalidate()
+
+    def _invalidate(self) -> None:
+        self._csr = None
 
     def build_from_control_dirs(self, depends_field_names: Optional[Iterable[str]] = None) -> None:
-        fields = list(depends_field_names) if depends_field_names else [
-            "Depends",
-            "Build-Depends",
-            "Build-Depends-Indep",
-            "Build-Depends-Arch",
-        ]
-        pkgname_re = re.compile(r"([A-Za-z0-9+_.:-]+)")
-        for pkg, base_path in self.package_dirs.items():
-            ctrl_path = base_path / "debian" / "control"
-            if not ctrl_path.is_file():
+        fields = [sys.intern(field) for field in depends_field_names] if depends_field_names else _DEPENDS_FIELDS
+        ctrl_paths = [base_path / "debian" / "control" for base_path in self.package_dirs.values()]
+        known = self.package_dirs.keys()
+        changed = False
+        # 读取与解析在线程池中并发完成，建边留在当前线程，图结构无需加锁
+        for pkg, read in zip(self.package_dirs, _read_controls(ctrl_paths)):
+            if read is None:
                 continue
-            try:
-                content = ctrl_path.read_text(encoding="utf-8")
-            except Exception:
-                continue
-            for stanza in _split_paragraphs(content):
+            pkg_deps: Set[str] = set()
+            for stanza in _cached_stanzas(*read):
                 for field in fields:
                     raw_value = stanza.get(field)
-                    if not raw_value:
-                        continue
-                    for dep_pkg in _parse_depends(raw_value, pkgname_re):
-                        if dep_pkg in self.package_dirs and dep_pkg != pkg:
-                            self.add_edge(dep_pkg, pkg)
-                        elif dep_pkg not in self.package_dirs:
-                            self.unresolved[pkg].add(dep_pkg)
+                    if raw_value:
+                        pkg_deps.update(_parse_depends(raw_value))
+            if not pkg_deps:
+                continue
+            missing = pkg_deps - known
+            if missing:
+                self.unresolved[pkg].update(missing)
+            pkg_deps &= known
+            pkg_deps.discard(pkg)
+            if pkg_deps:
+                self.rev[pkg].update(pkg_deps)
+                for dep_pkg in pkg_deps:
+                    self.adj[dep_pkg].add(pkg)
+                changed = True
+        if changed:
+            self._invalidate()
+
+    def _freeze(self) -> "_CSRGraph":
+        """整数编号的 CSR 视图（邻接与逆邻接），按名称排序编号；add_edge 后惰性重建。"""
+        if self._csr is None:
+            names = sorted(self.nodes)
+            ids = {name: idx for idx, name in enumerate(names)}
+            adj_indptr, adj_indices = [0], []
+            rev_indptr, rev_indices = [0], []
+            for name in names:
+                adj_indices.extend(sorted(ids[f] for f in self.adj.get(name, ()) if f in ids))
+                adj_indptr.append(len(adj_indices))
+                rev_indices.extend(sorted(ids[p] for p in self.rev.get(name, ()) if p in ids))
+                rev_indptr.append(len(rev_indices))
+            in_degree = array.array("i", [0]) * len(names)
+            for v in adj_indices:
+                in_degree[v] += 1
+            self._csr = _CSRGraph(names, ids, adj_indptr, adj_indices, rev_indptr, rev_indices, in_degree)
+        return self._csr
 
     def topo_sort(self, subset: Optional[Sequence[str]] = None, include_dependencies: bool = False) -> List[str]:
+        csr = self._freeze()
+        names = csr.names
+        n = len(names)
+        adj_indptr, adj_indices = csr.adj_indptr, csr.adj_indices
         if subset is None:
-            working_nodes = set(self.nodes)
+            working = bytearray(b"\x01") * n
+            working_ids = list(range(n))
         else:
-            working_nodes = set()
-            stack = list(subset)
-            while stack:
-                node = stack.pop()
-                if node in working_nodes:
-                    continue
-                if node not in self.nodes:
+            working = bytearray(n)
+            working_ids = []
+            stack: List[int] = []
+            for node in subset:
+                idx = csr.ids.get(node)
+                if idx is None:
                     raise KeyError(f"Package {node} not known in dependency graph")
-                working_nodes.add(node)
-                for predecessor in self.rev.get(node, ()):
-                    if predecessor not in working_nodes:
-                        stack.append(predecessor)
-        in_degree = {node: 0 for node in working_nodes}
-        for node in working_nodes:
-            for follower in self.adj.get(node, ()):
-                if follower in working_nodes:
-                    in_degree[follower] += 1
-        default_priority = len(self.order_hint) + len(working_nodes) + 5
-        queue: List[Tuple[int, str]] = []
-        for node, degree in in_degree.items():
-            if degree == 0:
-                priority = self.order_hint.get(node, default_priority)
-                heapq.heappush(queue, (priority, node))
-        sorted_nodes: List[str] = []
-        while queue:
-            _, node = heapq.heappop(queue)
-            sorted_nodes.append(node)
-            for follower in self.adj.get(node, ()):
-                if follower not in working_nodes:
+                stack.append(idx)
+            rev_indptr, rev_indices = csr.rev_indptr, csr.rev_indices
+            while stack:
+                u = stack.pop()
+                if working[u]:
                     continue
-                in_degree[follower] -= 1
-                if in_degree[follower] == 0:
-                    priority = self.order_hint.get(follower, default_priority)
-                    heapq.heappush(queue, (priority, follower))
-        if len(sorted_nodes) != len(working_nodes):
-            remaining = working_nodes - set(sorted_nodes)
+                working[u] = 1
+                working_ids.append(u)
+                stack.extend(rev_indices[rev_indptr[u] : rev_indptr[u + 1]])
+        # 工作集对前驱闭合，其中每个节点的入度恰为全图入度，直接复制预计算结果
+        in_degree = array.array("i", csr.in_degree)
+        seeds = [u for u in working_ids if in_degree[u] == 0]
+        priorities: Optional[List[int]] = None
+        if self.order_hint:
+            hint = self.order_hint
+            default_priority = len(hint) + len(working_ids) + 5
+            priorities = [hint.get(name, default_priority) for name in names]
+        order = _kahn_csr(adj_indptr, adj_indices, in_degree, working, seeds, priorities)
+        if len(order) != len(working_ids):
+            emitted = set(order)
+            remaining = [names[u] for u in working_ids if u not in emitted]
             raise ValueError(f"Cycle detected among: {', '.join(sorted(remaining))}")
+        sorted_nodes = [names[u] for u in order]
         if subset is None or include_dependencies:
             return sorted_nodes
         subset_set = set(subset)
         return [node for node in sorted_nodes if node in subset_set]
 
+    def target_prerequisites(self, subset: Sequence[str]) -> Tuple[List[str], Dict[str, Set[str]]]:
+        """Topological order of ``subset`` plus, per package, the nearest ``subset`` members it waits on.
+
+        Dependencies outside ``subset`` are treated as already built, but ordering through them is kept:
+        if A -> X -> B with only A and B in ``subset``, B still waits on A.
+        """
+        order = self.topo_sort(subset, include_dependencies=True)
+        subset_set = set(subset)
+        waits_on: Dict[str, Set[str]] = {}
+        for node in order:
+            pending: Set[str] = set()
+            for pred in self.rev.get(node, ()):
+                if pred in subset_set:
+                    pending.add(pred)
+                elif pred in waits_on:
+                    pending |= waits_on[pred]
+            waits_on[node] = pending
+        return (
+            [node for node in order if node in subset_set],
+            {node: waits_on[node] for node in order if node in subset_set},
+        )
+
+
+def _kahn_csr(
+    indptr: List[int],
+    indices: List[int],
+    in_degree: MutableSequence[int],
+    working: bytearray,
+    seeds: List[int],
+    priorities: Optional[List[int]],
+) -> List[int]:
+    """Kahn 主循环，仅操作整数编号；in_degree 原地递减。
+
+    priorities 为空时按 FIFO 出队，否则按 (priority, 编号) 最小堆出队。
+    编号即名称排序位置，与原先按名称打破平局等价。
+    """
+    order: List[int] = []
+    append = order.append
+    if priorities is None:
+        # 按编号入队以保证结果可复现
+        fifo = collections.deque(sorted(seeds))
+        popleft, push = fifo.popleft, fifo.append
+        while fifo:
+            u = popleft()
+            append(u)
+            for v in indices[indptr[u] : indptr[u + 1]]:
+                if working[v]:
+                    in_degree[v] -= 1
+                    if in_degree[v] == 0:
+                        push(v)
+        return order
+    heappush, heappop = heapq.heappush, heapq.heappop
+    queue: List[Tuple[int, int]] = []
+    for u in seeds:
+        heappush(queue, (priorities[u], u))
+    while queue:
+        _, u = heappop(queue)
+        append(u)
+        for v in indices[indptr[u] : indptr[u + 1]]:
+            if working[v]:
+                in_degree[v] -= 1
+                if in_degree[v] == 0:
+                    heappush(queue, (priorities[v], v))
+    return order
+
 
 def discover_debian_package_dirs(code_dir: Path, existing: Sequence[Tuple[str, Path]]) -> Dict[str, Path]:
     """Return package directories that contain debian/control, keyed by package name."""
@@ -127,6 +268,28 @@ def sort_packages_with_dependencies(
     return graph.topo_sort(target_packages, include_dependencies=True), unresolved
 
 
+def compute_build_dependencies(
+    package_dirs: Mapping[str, Path],
+    target_packages: Sequence[str],
+    order_hint: Optional[Mapping[str, int]] = None,
+) -> Tuple[List[str], Dict[str, Set[str]], Set[str]]:
+    """
+    计算并行调度所需的依赖信息：某包等待的待构建包全部完成后即可开始构建。
+
+    返回值:
+      - order: List[str]，待构建包的拓扑顺序（同等条件下遵循 order_hint），用作就绪包的优先级；
+      - waits_on: Dict[str, Set[str]]，每个包需要先完成的待构建包；
+      - unresolved: Set[str]，未在本地源码中找到的依赖名。
+    """
+    graph = PackageDepGraph(package_dirs, order_hint=order_hint)
+    graph.build_from_control_dirs()
+    unresolved: Set[str] = set()
+    for deps in graph.unresolved.values():
+        unresolved.update(deps)
+    order, waits_on = graph.target_prerequisites(target_packages)
+    return order, waits_on, unresolved
+
+
 def compute_series_toposort(
     package_dirs: Mapping[str, Path],
     target_packages: Sequence[str],
@@ -152,36 +315,21 @@ def compute_series_toposort(
         return [], unresolved
     topo_index = {name: idx for idx, name in enumerate(topo_all)}
 
-    # 构建无向邻接表用于弱连通分量拆分
-    relevant = set(topo_all)
-    undirected: Dict[str, Set[str]] = {node: set() for node in relevant}
-    for node in relevant:
-        for follower in graph.adj.get(node, ()):
-            if follower in relevant:
-                undirected[node].add(follower)
-                undirected[follower].add(node)
-        for predecessor in graph.rev.get(node, ()):
-            if predecessor in relevant:
-                undirected[node].add(predecessor)
-                undirected[predecessor].add(node)
-
-    series: List[List[str]] = []
-    visited: Set[str] = set()
-    # 以 topo 序做遍历顺序，确保组件内后续排序稳定
-    for node in topo_all:
-        if node in visited:
-            continue
-        stack = [node]
-        comp: List[str] = []
-        while stack:
-            cur = stack.pop()
-            if cur in visited:
-                continue
-            visited.add(cur)
-            comp.append(cur)
-            stack.extend(undirected[cur] - visited)
-        comp.sort(key=lambda n: topo_index[n])  # 组件内保持拓扑序
-        series.append(comp)
+    # 在 CSR 整数编号上做并查集得到弱连通分量，不再构建无向邻接表；
+    # topo_all 已包含全部前置依赖，遍历逆邻接即覆盖分量内所有边
+    csr = graph._freeze()
+    topo_ids = [csr.ids[name] for name in topo_all]
+    rev_indptr, rev_indices = csr.rev_indptr, csr.rev_indices
+    dsu = _DisjointSet(len(csr.names))
+    for u in topo_ids:
+        for v in rev_indices[rev_indptr[u] : rev_indptr[u + 1]]:
+            dsu.union(u, v)
+
+    # 按 topo 序分组，组件内天然保持拓扑序
+    components: Dict[int, List[str]] = {}
+    for name, u in zip(topo_all, topo_ids):
+        components.setdefault(dsu.find(u), []).append(name)
+    series = list(components.values())
 
     # 按组件大小降序，大小相同则以最早拓扑位置作为稳定排序
     series.sort(key=lambda comp: (-len(comp), topo_index.get(comp[0], 0)))
@@ -191,34 +339,114 @@ def compute_series_toposort(
 def _scan_package_dirs(code_dir: Path, max_depth: int = 3) -> List[Path]:
     if not code_dir.exists():
         return []
-    discovered: List[Path] = []
     code_dir = code_dir.expanduser()
-    for root, dirs, files in os.walk(code_dir):
-        root_path = Path(root)
-        rel_parts = root_path.relative_to(code_dir).parts
-        if len(rel_parts) > max_depth:
-            dirs[:] = []
+    found, subdirs = _scan_one_dir(str(code_dir))
+    if found is not None:
+        return [found]
+    if max_depth < 1 or not subdirs:
+        return []
+    # 各顶层子目录并发遍历，按原目录顺序拼接结果，保持与 os.walk 相同的先序
+    workers = min(32, (os.cpu_count() or 1) * 4, len(subdirs))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda path: _scan_tree(path, 1, max_depth), subdirs)
+        return [pkg_dir for result in results for pkg_dir in result]
+
+
+def _scan_tree(path: str, depth: int, max_depth: int) -> List[Path]:
+    discovered: List[Path] = []
+    stack = [(path, depth)]
+    while stack:
+        current, current_depth = stack.pop()
+        found, subdirs = _scan_one_dir(current)
+        if found is not None:
+            discovered.append(found)
             continue
-        ctrl = root_path / "debian" / "control"
-        if ctrl.is_file():
-            try:
-                resolved = root_path.resolve()
-            except Exception:
-                resolved = root_path
-            discovered.append(resolved)
-            dirs[:] = []
+        if current_depth < max_depth:
+            stack.extend((subdir, current_depth + 1) for subdir in reversed(subdirs))
     return discovered
 
 
-def _split_paragraphs(content: str) -> List[Dict[str, str]]:
-    paragraphs: List[Dict[str, str]] = []
+def _scan_one_dir(path: str) -> Tuple[Optional[Path], List[str]]:
+    """单次 scandir：若目录含 debian/control 则返回其解析后的路径，否则返回可继续下探的子目录。"""
+    subdirs: List[str] = []
+    has_debian = False
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.name == "debian" and entry.is_dir():
+                        has_debian = True
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                except OSError:
+                    continue
+    except OSError:
+        return None, []
+    if has_debian and os.path.isfile(os.path.join(path, "debian", "control")):
+        root_path = Path(path)
+        try:
+            return root_path.resolve(), []
+        except Exception:
+            return root_path, []
+    return None, subdirs
+
+
+def clear_control_cache() -> None:
+    """清空 control 文件解析缓存。"""
+    _STANZA_CACHE.clear()
+
+
+_ControlRead = Tuple[Tuple[str, int, int], Optional[List[Dict[str, str]]]]
+
+
+def _read_control(ctrl_path: Path) -> Optional[_ControlRead]:
+    """返回 (缓存键, 段落列表)；缓存命中时不读取文件（段落为 None），文件缺失或不可读时返回 None。
+
+    未命中时逐行流式解析，不把整个文件读成字符串再切分。
+    """
+    try:
+        st = ctrl_path.stat()
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    key = (str(ctrl_path), st.st_mtime_ns, st.st_size)
+    cached = _STANZA_CACHE.get(key[0])
+    if cached is not None and cached[0] == key[1] and cached[1] == key[2]:
+        return key, None
+    try:
+        with ctrl_path.open("r", encoding="utf-8", buffering=1 << 16) as handle:
+            return key, list(_iter_stanzas(handle))
+    except Exception:
+        return None
+
+
+def _read_controls(ctrl_paths: Sequence[Path]) -> List[Optional[_ControlRead]]:
+    if len(ctrl_paths) < CONTROL_READ_PARALLEL_MIN:
+        return [_read_control(path) for path in ctrl_paths]
+    workers = min(32, (os.cpu_count() or 1) * 4, len(ctrl_paths))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_read_control, ctrl_paths))
+
+
+def _cached_stanzas(key: Tuple[str, int, int], stanzas: Optional[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    """按路径缓存解析结果，(mtime_ns, size) 未变化的文件不再重复解析。"""
+    path, mtime_ns, size = key
+    if stanzas is None:
+        cached = _STANZA_CACHE.get(path)
+        return cached[2] if cached is not None else []
+    _STANZA_CACHE[path] = (mtime_ns, size, stanzas)
+    return stanzas
+
+
+def _iter_stanzas(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
     current: Dict[str, str] = {}
     current_key: Optional[str] = None
-    for raw_line in content.splitlines():
+    for raw_line in lines:
         line = raw_line.rstrip()
-        if not line.strip():
+        if not line:
             if current:
-                paragraphs.append(current)
+                yield current
                 current = {}
                 current_key = None
             continue
@@ -226,27 +454,27 @@ def _split_paragraphs(content: str) -> List[Dict[str, str]]:
             if current_key:
                 current[current_key] += " " + line.strip()
             continue
-        if ":" not in line:
+        match = _FIELD_RE.match(line)
+        if not match:
             continue
-        key, value = line.split(":", 1)
-        current_key = key.strip()
-        current[current_key] = value.strip()
+        key, value = match.groups()
+        current_key = sys.intern(key)
+        current[current_key] = value
     if current:
-        paragraphs.append(current)
-    return paragraphs
+        yield current
 
 
-def _parse_depends(value: str, pkgname_re: Pattern[str]) -> List[str]:
+def _parse_depends(value: str) -> List[str]:
     deps: List[str] = []
+    chars = _PKGNAME_CHARS
     for part in value.split(","):
-        token = part.split("|")[0].strip()
-        token = token.split("(")[0].strip()
-        token = token.split("[")[0].strip()
-        token = token.split("{")[0].strip()
-        if ":" in token:
-            token = token.split(":")[0].strip()
-        match = pkgname_re.match(token)
-        if not match:
-            continue
-        deps.append(match.group(1))
+        token = part.split("|", 1)[0].lstrip()
+        # 包名止于首个非法字符：版本 "("、架构 "["、替换变量 "{"、空白及 ":any" 限定符
+        end = 0
+        for ch in token:
+            if ch not in chars:
+                break
+            end += 1
+        if end:
+            deps.append(sys.intern(token[:end]))
     return deps
@@ -879,7 +879,11 @@ def run_debuild(work_dir: Path, extra: Sequence[str]) -> int:
     env.setdefault("DEBIAN_FRONTEND", "noninteractive")
     parallel = env.get("PARALLEL")
     if parallel:
-        env.setdefault("DEB_BUILD_OPTIONS", f"parallel={parallel}")
+        # 已有 DEB_BUILD_OPTIONS（如 nocheck）时也要补上 parallel=，否则 debian/rules 会串行编译
+        options = env.get("DEB_BUILD_OPTIONS", "").split()
+        if not any(opt.startswith("parallel=") for opt in options):
+            options.append(f"parallel={parallel}")
+        env["DEB_BUILD_OPTIONS"] = " ".join(options)
     cmd = build_cmd(extra)
     print_info(f"cwd={work_dir}")
     print_info(f"Starting debuild for {work_dir.name}")